@@ -26,21 +26,31 @@ class PreviewIterator:
 
     From the user point of view, this class supersedes the builtin iter()
     function: like iter(), it is called as PreviewIter(iterable).
+
+    The bytes of ``iterable`` are held in a ``bytes`` buffer (copied once,
+    unless ``iterable`` already is one) and walked with an integer cursor
+    between ``start`` and ``end``, so callers that know how many bytes
+    they need can also look at (and skip over) several of them at once,
+    and several iterators can share the same buffer (see :func:`split`).
     """
-    def __init__(self, data):
-        self._it = iter(data)
-        self._cached_values = []
-        self._preview_pos = 0
+    def __init__(self, data, start=0, end=None):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        self._data = data
+        self._pos = start
+        self._preview_pos = start
+        self._end = len(data) if end is None else end
 
     #pylint: disable=non-iterator-returned
     def __iter__(self):
         return self
 
     def __next__(self):
-        self.reset_preview()
-        if len(self._cached_values) > 0:
-            return self._cached_values.pop(0)
-        return next(self._it)
+        pos = self._pos
+        if pos >= self._end:
+            raise StopIteration
+        self._pos = self._preview_pos = pos + 1
+        return self._data[pos]
 
     def preview(self):
         """
@@ -58,14 +68,109 @@ class PreviewIterator:
         To force the "preview() iterator" to synchronize with the "next()
         iterator" (without calling :func:`next`), use :func:`reset_preview`.
         """
-        if self._preview_pos < len(self._cached_values):
-            value = self._cached_values[self._preview_pos]
-        else:
-            value = next(self._it)
-            self._cached_values.append(value)
-
-        self._preview_pos += 1
-        return value
+        pos = self._preview_pos
+        if pos >= self._end:
+            raise StopIteration
+        self._preview_pos = pos + 1
+        return self._data[pos]
 
     def reset_preview(self):
-        self._preview_pos = 0
+        self._preview_pos = self._pos
+
+    def reset(self, start, end):
+        """
+        Make the iterator walk bytes ``start`` to ``end`` of its buffer
+
+        This allows a single iterator to be reused for successive chunks
+        of the same data, instead of creating one per chunk.
+        """
+        self._pos = self._preview_pos = start
+        self._end = end
+
+    @property
+    def position(self):
+        """The offset of the byte that :func:`next` will return"""
+        return self._pos
+
+    def peek(self, size):
+        """
+        Return up to ``size`` bytes starting at the current position
+
+        The iterator is not moved; fewer than ``size`` bytes are returned
+        if the end of the data is reached first.
+
+        :rtype: bytes
+        """
+        return self._data[self._pos:min(self._pos + size, self._end)]
+
+    def advance(self, size):
+        """
+        Move the iterator ``size`` bytes forward
+
+        :raise StopIteration: There are less than ``size`` bytes left; the
+                              iterator is not modified in this case.
+        """
+        pos = self._pos + size
+        if pos > self._end:
+            raise StopIteration
+        self._pos = self._preview_pos = pos
+
+    def read(self, size):
+        """
+        Return the next ``size`` bytes, moving the iterator past them
+
+        :raise StopIteration: There are less than ``size`` bytes left; like
+                              :func:`next`, the iterator is left exhausted
+                              in this case.
+
+        :rtype: bytes
+        """
+        start = self._pos
+        end = start + size
+        if end > self._end:
+            self._pos = self._preview_pos = self._end
+            raise StopIteration
+        self._pos = self._preview_pos = end
+        return self._data[start:end]
+
+    def read_until(self, value):
+        """
+        Return the bytes up to the next ``value`` octet
+
+        The iterator is moved past the ``value`` octet itself, which is not
+        included in the returned bytes.
+
+        :raise StopIteration: ``value`` does not occur in the remaining
+                              data; like :func:`next`, the iterator is left
+                              exhausted in this case.
+
+        :rtype: bytes
+        """
+        end = self._data.find(value, self._pos, self._end)
+        if end == -1:
+            self._pos = self._preview_pos = self._end
+            raise StopIteration
+        chunk = self._data[self._pos:end]
+        self._pos = self._preview_pos = end + 1
+        return chunk
+
+    def split(self, size):
+        """
+        Return a new iterator over the next ``size`` bytes
+
+        The new iterator shares this iterator's buffer (no data is copied),
+        and this iterator is moved past those bytes.
+
+        :raise StopIteration: There are less than ``size`` bytes left; like
+                              :func:`next`, the iterator is left exhausted
+                              in this case.
+
+        :rtype: PreviewIterator
+        """
+        start = self._pos
+        end = start + size
+        if end > self._end:
+            self._pos = self._preview_pos = self._end
+            raise StopIteration
+        self._pos = self._preview_pos = end
+        return PreviewIterator(self._data, start, end)
@@ -215,8 +215,8 @@ class MMSMessage:
 
         This uses the `~:class:messaging.mms.mms_pdu.MMSEncoder` internally
 
-        :return: The binary-encoded MMS data, as an array of bytes
-        :rtype: array.array('B')
+        :return: The binary-encoded MMS data, as a sequence of bytes
+        :rtype: bytes
         """
         from messaging.mms import mms_pdu
         encoder = mms_pdu.MMSEncoder()
@@ -230,12 +230,9 @@ class MMSMessage:
 
         :param filename: The path where to store the message data
         :type filename: str
-
-        :rtype array.array('B')
-        :return: The binary-encode MMS data, as an array of bytes
         """
         with open(filename, 'wb') as f:
-            self.encode().tofile(f)
+            f.write(self.encode())
 
     @staticmethod
     def from_data(data):
@@ -548,7 +545,7 @@ class DataPart:
             return self._data
 
         elif self._filename is not None:
-            with open(self._filename, 'r') as f:
+            with open(self._filename, 'rb') as f:
                 self._data = f.read()
             return self._data
 
@@ -12,25 +12,23 @@
 """MMS Data Unit structure encoding and decoding classes"""
 
 from __future__ import with_statement
-import array
+import functools
 import os
-import random
+import sys
 import logging
 
 from messaging.mms import message, wsp_pdu
 from messaging.mms.iterator import PreviewIterator
 
-
-def flatten_list(x):
-    """Flattens ``x`` into a single list"""
-    result = []
-    for el in x:
-        if hasattr(el, "__iter__") and not isinstance(el, str):
-            result.extend(flatten_list(el))
-        else:
-            result.append(el)
-    return result
-
+__all__ = [
+    'MMSDecoder', 'MMSEncoder', 'CONTENT_TYPE_NAME', 'ADDRESS_PRESENT_TOKEN',
+    'INSERT_ADDRESS_TOKEN', 'mms_field_names', 'mms_field_numbers',
+    'encoded_mms_field_names', 'mms_field_decoders', 'mms_field_encoders',
+    'boolean_values', 'message_class_values', 'message_type_values',
+    'encoded_message_type_values', 'priority_values',
+    'sender_visibility_values', 'response_status_values', 'status_values',
+    'encoded_status_values',
+]
 
 mms_field_names = {
     0x01: ('Bcc', 'encoded_string_value'),
@@ -59,17 +57,140 @@ mms_field_names = {
     0x18: ('Transaction-Id', 'text_string'),
 }
 
+CONTENT_TYPE_NAME = sys.intern(mms_field_names[0x04][0])
+
+# Reverse lookup table for mms_field_names, in the format:
+# {<field name>: (<assigned number>, <value type>)}
+# The field names used here, and as the names of decoded MMS headers, are
+# interned, so looking up the headers of a decoded message (or any name
+# passed through sys.intern) only takes an identity check per probe
+mms_field_numbers = dict((sys.intern(name), (assigned_number, value_type))
+                         for assigned_number, (name, value_type)
+                         in mms_field_names.items())
+
+# The encoded MMS-field-name of each MMS field, in the format:
+# {<field name>: <bytes>}
+# All assigned numbers fit in seven bits, so each is a single short-integer
+# octet: the number with its most significant bit set
+assert max(mms_field_names) <= 0x7f
+encoded_mms_field_names = dict(
+    (name, bytes((assigned_number | 0x80,)))
+    for name, (assigned_number, value_type) in mms_field_numbers.items())
+
+
+# Headers encode_message_header writes itself, ahead of (or, for
+# Content-Type, after) all the others
+_leading_header_names = frozenset([
+    'Message-Type', 'Transaction-Id', 'MMS-Version', 'X-Mms-Message-Type',
+    'X-Mms-Transaction-Id', 'X-Mms-Version', CONTENT_TYPE_NAME])
+
+# Well-known tokens of the MMS field values, in the format:
+# {<octet>: <value>}
+boolean_values = {128: True, 129: False}
+
+message_class_values = {
+    128: 'Personal',
+    129: 'Advertisement',
+    130: 'Informational',
+    131: 'Auto',
+}
+
+message_type_values = {
+    0x80: 'm-send-req',
+    0x81: 'm-send-conf',
+    0x82: 'm-notification-ind',
+    0x83: 'm-notifyresp-ind',
+    0x84: 'm-retrieve-conf',
+    0x85: 'm-acknowledge-ind',
+    0x86: 'm-delivery-ind',
+}
+
+# Reverse lookup table for message_type_values, with the octets already
+# encoded, in the format: {<message type>: <bytes>}
+encoded_message_type_values = dict((message_type, bytes((byte,)))
+                                   for byte, message_type
+                                   in message_type_values.items())
+
+priority_values = {128: 'Low', 129: 'Normal', 130: 'High'}
+
+sender_visibility_values = {128: 'Hide', 129: 'Show'}
+
+response_status_values = {
+    0x80: 'Ok',
+    0x81: 'Error-unspecified',
+    0x82: 'Error-service-denied',
+    0x83: 'Error-message-format-corrupt',
+    0x84: 'Error-sending-address-unresolved',
+    0x85: 'Error-message-not-found',
+    0x86: 'Error-network-problem',
+    0x87: 'Error-content-not-accepted',
+    0x88: 'Error-unsupported-message',
+}
+
+status_values = {
+    0x80: 'Expired',
+    0x81: 'Retrieved',
+    0x82: 'Rejected',
+    0x83: 'Deferred',
+    0x84: 'Unrecognised',
+}
+
+# Reverse lookup table for status_values, with the octets already encoded,
+# in the format: {<status>: <bytes>}
+encoded_status_values = dict((status, bytes((byte,)))
+                             for byte, status in status_values.items())
+
+# The From-value tokens, see [4], section 7.2.11
+ADDRESS_PRESENT_TOKEN = b'\x80'
+INSERT_ADDRESS_TOKEN = b'\x81'
+
+# The From-value asking the MMSC to insert the sender's address, which
+# does not depend on anything else
+_insert_address_from_value = (wsp_pdu.Encoder.encode_value_length(1)
+                              + INSERT_ADDRESS_TOKEN)
+
+
+def _decode_token(byte_iter, tokens, error=None):
+    """
+    Decodes the well-known token pointed by ``byte_iter``
+
+    :param tokens: The value of each token, in the format {<octet>: <value>}
+    :type tokens: dict
+    :param error: If specified, the message of the DecodeError to raise
+                  (formatted with the octet) when the octet pointed by
+                  ``byte_iter`` is not one of ``tokens``
+    :type error: str
+
+    :raise wsp_pdu.DecodeError: The token is unknown and ``error`` is
+                                specified. ``byte_iter`` will not be modified.
+
+    :return: The value of the token, or None if it is unknown (in which case
+             ``byte_iter`` is not modified)
+    """
+    byte = byte_iter.preview()
+    value = tokens.get(byte)
+    if value is None:
+        byte_iter.reset_preview()
+        if error is not None:
+            raise wsp_pdu.DecodeError(error % hex(byte))
+        return None
+
+    next(byte_iter)
+    return value
+
 
 class MMSDecoder(wsp_pdu.Decoder):
     """A decoder for MMS messages"""
 
+    __slots__ = ('_mms_data', '_mms_message', '_parts')
+
     def __init__(self, filename=None):
         """
         :param filename: If specified, decode the content of the MMS
                          message file with this name
         :type filename: str
         """
-        self._mms_data = array.array('B')
+        self._mms_data = b''
         self._mms_message = message.MMSMessage()
         self._parts = []
 
@@ -85,25 +206,22 @@ class MMSDecoder(wsp_pdu.Decoder):
         :return: The decoded MMS data
         :rtype: MMSMessage
         """
-        num_bytes = os.stat(filename)[6]
-        data = array.array('B')
-
         with open(filename, 'rb') as f:
-            data.fromfile(f, num_bytes)
-
-        return self.decode_data(data)
+            return self.decode_data(f.read())
 
     def decode_data(self, data):
         """
         Decode the specified MMS message data
 
         :param data: The MMS message data to decode
-        :type data: array.array('B')
+        :type data: bytes (or any other bytes-like object)
 
         :return: The decoded MMS data
         :rtype: MMSMessage
         """
         self._mms_message = message.MMSMessage()
+        if not isinstance(data, bytes):
+            data = bytes(data)
         self._mms_data = data
         body_iter = self.decode_message_header()
         self.decode_message_body(body_iter)
@@ -132,23 +250,21 @@ class MMSDecoder(wsp_pdu.Decoder):
         # The next few headers will not be in a specific order, except for
         # "Content-Type", which should be the last header
         # According to [4], MMS header field names will be short integers
-        content_type_found = False
-        header = ''
-        while content_type_found == False:
+        headers = self._mms_message.headers
+        while True:
             try:
-                header, value = self.decode_header(data_iter)
+                try:
+                    assigned_number, header, value = \
+                            self.decode_mms_field(data_iter)
+                except wsp_pdu.DecodeError:
+                    assigned_number = None
+                    header, value = wsp_pdu.Decoder.decode_header(data_iter)
             except StopIteration:
                 break
 
-            if header == mms_field_names[0x04][0]:
-                content_type_found = True
-            else:
-                self._mms_message.headers[header] = value
-
-        if header == 'Content-Type':
-            # Otherwise it might break Content-Location
-            # content_type, params = value
-            self._mms_message.headers[header] = value
+            headers[header] = value
+            if assigned_number == 0x04:  # Content-Type
+                break
 
         return data_iter
 
@@ -156,9 +272,9 @@ class MMSDecoder(wsp_pdu.Decoder):
         """
         Decodes the MMS message body
 
-        :param data_iter: an iterator over the sequence of bytes of the MMS
-                          body
-        :type data_iter: iter
+        :param data_iter: an iterator over the MMS message data, positioned
+                          at the start of the MMS body
+        :type data_iter: PreviewIterator
         """
         ######### MMS body: headers ###########
         # Get the number of data parts in the MMS body
@@ -169,45 +285,10 @@ class MMSDecoder(wsp_pdu.Decoder):
 
         logging.debug('Number of data entries (parts) in MMS body: %i' % num_entries)
 
-        ########## MMS body: entries ##########
-        # For every data "part", we have to read the following sequence:
-        # <length of content-type + other possible headers>,
-        # <length of data>,
-        # <content-type + other possible headers>,
-        # <data>
-        for part_num in range(num_entries):
-            logging.debug('\nPart %d:\n------' % part_num)
-            headers_len = self.decode_uint_var(data_iter)
-            data_len = self.decode_uint_var(data_iter)
-
-            # Prepare to read content-type + other possible headers
-            ct_field_bytes = []
-            for i in range(headers_len):
-                ct_field_bytes.append(next(data_iter))
-
-            ct_iter = PreviewIterator(ct_field_bytes)
-            # Get content type
-            ctype, ct_parameters = self.decode_content_type_value(ct_iter)
-            headers = {'Content-Type': (ctype, ct_parameters)}
-
-            # Now read other possible headers until <headers_len> bytes
-            # have been read
-            while True:
-                try:
-                    hdr, value = self.decode_header(ct_iter)
-                    headers[hdr] = value
-                except StopIteration:
-                    break
-
-            # Data (note: this is not null-terminated)
-            data = array.array('B')
-            for i in range(data_len):
-                data.append(next(data_iter))
-
-            part = message.DataPart()
-            part.set_data(data, ctype)
-            part.content_type_parameters = ct_parameters
-            part.headers = headers
+        parts, pos = _parse_parts(self._mms_data, data_iter.position,
+                                  num_entries)
+        data_iter.advance(pos - data_iter.position)
+        for part in parts:
             self._mms_message.add_data_part(part)
 
     @staticmethod
@@ -263,24 +344,40 @@ class MMSDecoder(wsp_pdu.Decoder):
                  (<str:MMS-field-name>, <str:MMS-value>)
         :rtype: tuple
         """
+        return MMSDecoder.decode_mms_field(byte_iter)[1:]
+
+    @staticmethod
+    def decode_mms_field(byte_iter):
+        """
+        Decodes the MMS header pointed by ``byte_iter``, like
+        :func:`decode_mms_header`, but also returns its assigned number
+
+        :raise wsp_pdu.DecodeError: The MMS field name could not be parsed.
+                                    ``byte_iter`` will not be modified.
+
+        :return: The decoded MMS header, in the format:
+                 (<int:assigned number>, <str:MMS-field-name>,
+                  <str:MMS-value>)
+        :rtype: tuple
+        """
         # Get the MMS-field-name
         mms_field_name = ''
         preview = byte_iter.preview()
         byte = wsp_pdu.Decoder.decode_short_integer_from_byte(preview)
 
-        if byte in mms_field_names:
-            next(byte_iter)
-            mms_field_name = mms_field_names[byte][0]
-        else:
+        field = mms_field_decoders[byte]
+        if field is None:
             byte_iter.reset_preview()
             raise wsp_pdu.DecodeError('Invalid MMS Header: could '
                                       'not decode MMS field name')
 
+        next(byte_iter)
+        mms_field_name, decode_value = field
+
         # Now get the MMS-value
         mms_value = ''
         try:
-            name = mms_field_names[byte][1]
-            mms_value = getattr(MMSDecoder, 'decode_%s' % name)(byte_iter)
+            mms_value = decode_value(byte_iter)
         except wsp_pdu.DecodeError as e:
             raise wsp_pdu.DecodeError('Invalid MMS Header: Could '
                                       'not decode MMS-value: %s' % e)
@@ -289,7 +386,7 @@ class MMSDecoder(wsp_pdu.Decoder):
                                'unimplemented decoding operation. Tried to '
                                'decode header: %s' % mms_field_name)
 
-        return mms_field_name, mms_value
+        return byte, mms_field_name, mms_value
 
     @staticmethod
     def decode_encoded_string_value(byte_iter):
@@ -345,13 +442,8 @@ class MMSDecoder(wsp_pdu.Decoder):
         :return: The value for the field
         :rtype: bool
         """
-        byte = byte_iter.preview()
-        if byte not in (128, 129):
-            byte_iter.reset_preview()
-            raise wsp_pdu.DecodeError('Error parsing boolean value '
-                                      'for byte: %s' % hex(byte))
-        byte = next(byte_iter)
-        return byte == 128
+        return _decode_token(byte_iter, boolean_values,
+                             'Error parsing boolean value for byte: %s')
 
     @staticmethod
     def decode_delivery_time_value(byte_iter):
@@ -408,19 +500,11 @@ class MMSDecoder(wsp_pdu.Decoder):
         :return: The decoded message class
         :rtype: str
         """
-        class_identifiers = {
-            128: 'Personal',
-            129: 'Advertisement',
-            130: 'Informational',
-            131: 'Auto',
-        }
-        byte = byte_iter.preview()
-        if byte in class_identifiers:
-            next(byte_iter)
-            return class_identifiers[byte]
+        message_class = _decode_token(byte_iter, message_class_values)
+        if message_class is None:
+            return wsp_pdu.Decoder.decode_token_text(byte_iter)
 
-        byte_iter.reset_preview()
-        return wsp_pdu.Decoder.decode_token_text(byte_iter)
+        return message_class
 
     @staticmethod
     def decode_message_type_value(byte_iter):
@@ -432,23 +516,11 @@ class MMSDecoder(wsp_pdu.Decoder):
         :return: The decoded message type, or '<unknown>'
         :rtype: str
         """
-        message_types = {
-            0x80: 'm-send-req',
-            0x81: 'm-send-conf',
-            0x82: 'm-notification-ind',
-            0x83: 'm-notifyresp-ind',
-            0x84: 'm-retrieve-conf',
-            0x85: 'm-acknowledge-ind',
-            0x86: 'm-delivery-ind',
-        }
-
-        byte = byte_iter.preview()
-        if byte in message_types:
-            next(byte_iter)
-            return message_types[byte]
+        message_type = _decode_token(byte_iter, message_type_values)
+        if message_type is None:
+            return '<unknown>'
 
-        byte_iter.reset_preview()
-        return '<unknown>'
+        return message_type
 
     @staticmethod
     def decode_priority_value(byte_iter):
@@ -463,16 +535,8 @@ class MMSDecoder(wsp_pdu.Decoder):
         :return: The decoded priority value
         :rtype: str
         """
-        priorities = {128: 'Low', 129: 'Normal', 130: 'High'}
-
-        byte = byte_iter.preview()
-        if byte in priorities:
-            byte = next(byte_iter)
-            return priorities[byte]
-
-        byte_iter.reset_preview()
-        raise wsp_pdu.DecodeError('Error parsing Priority value '
-                                  'for byte: %s' % byte)
+        return _decode_token(byte_iter, priority_values,
+                             'Error parsing Priority value for byte: %s')
 
     @staticmethod
     def decode_sender_visibility_value(byte_iter):
@@ -492,15 +556,9 @@ class MMSDecoder(wsp_pdu.Decoder):
         :return: The sender visibility: 'Hide' or 'Show'
         :rtype: str
         """
-        byte = byte_iter.preview()
-        if byte not in (128, 129):
-            byte_iter.reset_preview()
-            raise wsp_pdu.DecodeError('Error parsing sender visibility '
-                                      'value for byte: %s' % hex(byte))
-
-        byte = next(byte_iter)
-        value = 'Hide' if byte == 128 else 'Show'
-        return value
+        return _decode_token(byte_iter, sender_visibility_values,
+                             'Error parsing sender visibility value '
+                             'for byte: %s')
 
     @staticmethod
     def decode_response_status_value(byte_iter):
@@ -517,19 +575,7 @@ class MMSDecoder(wsp_pdu.Decoder):
         :return: The decoded Response-status-value
         :rtype: str
         """
-        response_status_values = {
-            0x80: 'Ok',
-            0x81: 'Error-unspecified',
-            0x82: 'Error-service-denied',
-            0x83: 'Error-message-format-corrupt',
-            0x84: 'Error-sending-address-unresolved',
-            0x85: 'Error-message-not-found',
-            0x86: 'Error-network-problem',
-            0x87: 'Error-content-not-accepted',
-            0x88: 'Error-unsupported-message',
-        }
-        byte = byte_iter.preview()
-        next(byte_iter)
+        byte = next(byte_iter)
         # Return error unspecified if it couldn't be decoded
         return response_status_values.get(byte, 0x81)
 
@@ -547,14 +593,6 @@ class MMSDecoder(wsp_pdu.Decoder):
         :return: The decoded Status-value
         :rtype: str
         """
-        status_values = {
-            0x80: 'Expired',
-            0x81: 'Retrieved',
-            0x82: 'Rejected',
-            0x83: 'Deferred',
-            0x84: 'Unrecognised',
-        }
-
         byte = next(byte_iter)
         # Return an unrecognised state if it couldn't be decoded
         return status_values.get(byte, 0x84)
@@ -586,9 +624,102 @@ class MMSDecoder(wsp_pdu.Decoder):
         raise wsp_pdu.DecodeError('Unrecognized token value: %s' % hex(token))
 
 
+# The name of each MMS field and the MMSDecoder method decoding its value,
+# indexed by assigned number (any short-integer value); None for the
+# numbers not assigned to a field
+mms_field_decoders = [None] * 0x80
+for _assigned_number, (_name, _value_type) in mms_field_names.items():
+    mms_field_decoders[_assigned_number] = (
+        sys.intern(_name), getattr(MMSDecoder, 'decode_%s' % _value_type))
+
+del _assigned_number, _name, _value_type
+
+
+def _parse_parts(buf, pos, num_entries):
+    """
+    Decodes ``num_entries`` MMS body entries from ``buf``, starting at ``pos``
+
+    For every data "part", we have to read the following sequence:
+    <length of content-type + other possible headers>,
+    <length of data>,
+    <content-type + other possible headers>,
+    <data>
+
+    :param buf: The MMS message data
+    :type buf: bytes
+    :param pos: The offset of the first entry in ``buf``
+    :type pos: int
+    :param num_entries: The number of entries to decode
+    :type num_entries: int
+
+    :raise StopIteration: ``buf`` ends before the last entry does
+
+    :return: The decoded parts, and the offset following the last entry
+    :rtype: tuple
+    """
+    end = len(buf)
+    decode_content_type_value = MMSDecoder.decode_content_type_value
+    decode_header = MMSDecoder.decode_header
+    # A single iterator, moved over the headers of each entry in turn
+    ct_iter = PreviewIterator(buf, pos, pos)
+    parts = []
+    for part_num in range(num_entries):
+        logging.debug('Part %d', part_num)
+        # HeadersLen and DataLen (uintvars)
+        headers_len = 0
+        while True:
+            if pos >= end:
+                raise StopIteration
+            byte = buf[pos]
+            pos += 1
+            headers_len = (headers_len << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                break
+
+        data_len = 0
+        while True:
+            if pos >= end:
+                raise StopIteration
+            byte = buf[pos]
+            pos += 1
+            data_len = (data_len << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                break
+
+        # Content-type + other possible headers
+        headers_end = pos + headers_len
+        if headers_end > end:
+            raise StopIteration
+
+        ct_iter.reset(pos, headers_end)
+        ctype, ct_parameters = decode_content_type_value(ct_iter)
+        headers = {CONTENT_TYPE_NAME: (ctype, ct_parameters)}
+        while True:
+            try:
+                hdr, value = decode_header(ct_iter)
+                headers[hdr] = value
+            except StopIteration:
+                break
+
+        # Data (note: this is not null-terminated)
+        pos = headers_end + data_len
+        if pos > end:
+            raise StopIteration
+
+        part = message.DataPart()
+        part.set_data(buf[headers_end:pos], ctype)
+        part.content_type_parameters = ct_parameters
+        part.headers = headers
+        parts.append(part)
+
+    return parts, pos
+
+
 class MMSEncoder(wsp_pdu.Encoder):
     """MMS Encoder"""
 
+    __slots__ = ('_mms_message',)
+
     def __init__(self):
         self._mms_message = message.MMSMessage()
 
@@ -600,12 +731,12 @@ class MMSEncoder(wsp_pdu.Encoder):
         :type mms_message: MMSMessage
 
         :return: The binary-encoded MMS data, as a sequence of bytes
-        :rtype: array.array('B')
+        :rtype: bytes
         """
         self._mms_message = mms_message
-        msg_data = self.encode_message_header()
-        msg_data.extend(self.encode_message_body())
-        return msg_data
+        encoded = bytearray(self.encode_message_header())
+        self._write_message_body(encoded)
+        return bytes(encoded)
 
     def encode_message_header(self):
         """
@@ -615,8 +746,8 @@ class MMSEncoder(wsp_pdu.Encoder):
         All "constant" encoded values found/used in this method
         are also defined in [4]. For a good example, see [2].
 
-        :return: the MMS PDU header, as an array of bytes
-        :rtype: array.array('B')
+        :return: the MMS PDU header, as a sequence of bytes
+        :rtype: bytes
         """
         # See [4], chapter 8 for info on how to use these
         # from_types = {'Address-present-token': 0x80,
@@ -624,23 +755,18 @@ class MMSEncoder(wsp_pdu.Encoder):
 
         # content_types = {'application/vnd.wap.multipart.related': 0xb3}
 
-        # Create an array of 8-bit values
-        message_header = array.array('B')
+        message_header = bytearray()
 
         headers_to_encode = self._mms_message.headers
 
         # If the user added any of these to the message manually
         # (X- prefix) use those instead
-        for hdr in ('X-Mms-Message-Type', 'X-Mms-Transaction-Id',
-                    'X-Mms-Version'):
-            if hdr in headers_to_encode:
-                if hdr == 'X-Mms-Version':
-                    clean_header = 'MMS-Version'
-                else:
-                    clean_header = hdr.replace('X-Mms-', '', 1)
-
-                headers_to_encode[clean_header] = headers_to_encode[hdr]
-                del headers_to_encode[hdr]
+        message_type = headers_to_encode.get(
+                'X-Mms-Message-Type', headers_to_encode.get('Message-Type'))
+        transaction_id = headers_to_encode.get(
+                'X-Mms-Transaction-Id', headers_to_encode.get('Transaction-Id'))
+        mms_version = headers_to_encode.get(
+                'X-Mms-Version', headers_to_encode.get('MMS-Version'))
 
          # First 3  headers (in order), according to [4]:
         ################################################
@@ -649,10 +775,10 @@ class MMSEncoder(wsp_pdu.Encoder):
         # - X-Mms-Version
 
         ### Start of Message-Type verification
-        if 'Message-Type' not in headers_to_encode:
+        if message_type is None:
             # Default to 'm-retrieve-conf'; we don't need a To/CC field for
             # this (see WAP-209, section 6.3, table 5)
-            headers_to_encode['Message-Type'] = 'm-retrieve-conf'
+            message_type = 'm-retrieve-conf'
 
         # See if the chosen message type is valid, given the message's
         # other headers. NOTE: we only distinguish between 'm-send-req'
@@ -660,7 +786,7 @@ class MMSEncoder(wsp_pdu.Encoder):
         # (requires no destination number) - if "Message-Type" is
         # something else, we assume the message creator knows
         # what she is doing
-        if headers_to_encode['Message-Type'] == 'm-send-req':
+        if message_type == 'm-send-req':
             found_dest_address = False
             for address_type in ('To', 'Cc', 'Bc'):
                 if address_type in headers_to_encode:
@@ -668,39 +794,38 @@ class MMSEncoder(wsp_pdu.Encoder):
                     break
 
             if not found_dest_address:
-                headers_to_encode['Message-Type'] = 'm-retrieve-conf'
+                message_type = 'm-retrieve-conf'
         ### End of Message-Type verification
 
         ### Start of Transaction-Id verification
-        if 'Transaction-Id' not in headers_to_encode:
-            trans_id = str(random.randint(1000, 9999))
-            headers_to_encode['Transaction-Id'] = trans_id
+        if transaction_id is None:
+            transaction_id = os.urandom(3).hex()
         ### End of Transaction-Id verification
 
         ### Start of MMS-Version verification
-        if 'MMS-Version' not in headers_to_encode:
-            headers_to_encode['MMS-Version'] = '1.0'
+        if mms_version is None:
+            mms_version = '1.0'
 
         # Encode the first three headers, in correct order
-        for hdr in ('Message-Type', 'Transaction-Id', 'MMS-Version'):
-            message_header.extend(
-                MMSEncoder.encode_header(hdr, headers_to_encode[hdr]))
-            del headers_to_encode[hdr]
+        _write_header(message_header, 'Message-Type', message_type)
+        _write_header(message_header, 'Transaction-Id', transaction_id)
+        _write_header(message_header, 'MMS-Version', mms_version)
 
         # Encode all remaining MMS message headers, except "Content-Type"
         # -- this needs to be added last, according [2] and [4]
-        for hdr in headers_to_encode:
-            if hdr != 'Content-Type':
-                message_header.extend(
-                    MMSEncoder.encode_header(hdr, headers_to_encode[hdr]))
+        remaining = [hdr for hdr in headers_to_encode
+                     if hdr not in _leading_header_names]
+        for hdr in remaining:
+            _write_header(message_header, hdr, headers_to_encode[hdr])
 
         # Ok, now only "Content-type" should be left
-        content_type, ct_parameters = headers_to_encode['Content-Type']
-        message_header.extend(MMSEncoder.encode_mms_field_name('Content-Type'))
-        ret = MMSEncoder.encode_content_type_value(content_type, ct_parameters)
-        message_header.extend(flatten_list(ret))
+        content_type, ct_parameters = headers_to_encode[CONTENT_TYPE_NAME]
+        message_header += (
+                encoded_mms_field_names[CONTENT_TYPE_NAME]
+                + MMSEncoder.encode_content_type_value(content_type,
+                                                       ct_parameters))
 
-        return message_header
+        return bytes(message_header)
 
     def encode_message_body(self):
         """
@@ -741,30 +866,27 @@ class MMSEncoder(wsp_pdu.Encoder):
                              <ContentType>) octets  the part's headers
             Data             <DataLen> octets       the part's data
 
-        :return: The binary-encoded MMS PDU body, as an array of bytes
-        :rtype: array.array('B')
+        :return: The binary-encoded MMS PDU body, as a sequence of bytes
+        :rtype: bytes
         """
-        message_body = array.array('B')
+        message_body = bytearray()
+        self._write_message_body(message_body)
+        return bytes(message_body)
 
-        #TODO: enable encoding of MMSs without SMIL file
-        ########## MMS body: header ##########
-        # Parts: SMIL file + <number of data elements in each slide>
-        num_entries = 1
-        for page in self._mms_message._pages:
-            num_entries += page.number_of_parts()
-
-        num_entries += len(self._mms_message._data_parts)
+    def _write_message_body(self, message_body):
+        """
+        Binary-encodes the MMS body data at the end of ``message_body``
 
-        message_body.extend(self.encode_uint_var(num_entries))
+        See :func:`encode_message_body`; :func:`encode` uses this to write
+        the body into the same buffer as the header, which saves two extra
+        copies of the (potentially large) part data.
 
-        ########## MMS body: entries ##########
-        # For every data "part", we have to add the following sequence:
-        # <length of content-type + other possible headers>,
-        # <length of data>,
-        # <content-type + other possible headers>,
-        # <data>.
-
-        # Gather the data parts, adding the MMS message's SMIL file
+        :param message_body: The buffer to append the encoded body to
+        :type message_body: bytearray
+        """
+        #TODO: enable encoding of MMSs without SMIL file
+        # Gather the data parts: the MMS message's SMIL file, the data
+        # elements in each slide, and the parts not tied to any slide
         smil_part = message.DataPart()
         smil = self._mms_message.smil()
         smil_part.set_data(smil, 'application/smil')
@@ -776,32 +898,40 @@ class MMSEncoder(wsp_pdu.Encoder):
                 if part_tuple is not None:
                     parts.append(part_tuple[0])
 
-        for part in parts:
-            name, val_type = part.headers['Content-Type']
-            part_content_type = self.encode_content_type_value(name, val_type)
+        parts.extend(self._mms_message._data_parts)
+
+        ########## MMS body: header ##########
+        message_body += self.encode_uint_var(len(parts))
 
-            encoded_part_headers = []
+        ########## MMS body: entries ##########
+        # For every data "part", we have to add the following sequence:
+        # <length of content-type + other possible headers>,
+        # <length of data>,
+        # <content-type + other possible headers>,
+        # <data>.
+        for part in parts:
+            data = part.data
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+
+            # ContentType and Headers entries
+            name, val_type = part.headers[CONTENT_TYPE_NAME]
+            encoded_part_headers = bytearray(
+                    self.encode_content_type_value(name, val_type))
             for hdr in part.headers:
-                if hdr == 'Content-Type':
+                if hdr == CONTENT_TYPE_NAME:
                     continue
-                encoded_part_headers.extend(
-                        wsp_pdu.Encoder.encode_header(hdr, part.headers[hdr]))
+                encoded_part_headers += wsp_pdu.Encoder.encode_header(
+                                                        hdr, part.headers[hdr])
 
             # HeadersLen entry (length of the ContentType and
-            #  Headers fields combined)
-            headers_len = len(part_content_type) + len(encoded_part_headers)
-            message_body.extend(self.encode_uint_var(headers_len))
-            # DataLen entry (length of the Data field)
-            message_body.extend(self.encode_uint_var(len(part)))
-            # ContentType entry
-            message_body.extend(part_content_type)
-            # Headers
-            message_body.extend(encoded_part_headers)
+            #  Headers fields combined), DataLen entry (length of the
+            #  Data field), then the two entries above
+            message_body += (self.encode_uint_var(len(encoded_part_headers))
+                             + self.encode_uint_var(len(data))
+                             + encoded_part_headers)
             # Data (note: we do not null-terminate this)
-            for char in part.data:
-                message_body.append(ord(char))
-
-        return message_body
+            message_body += data
 
     @staticmethod
     def encode_header(header_field_name, header_value):
@@ -830,39 +960,9 @@ class MMSEncoder(wsp_pdu.Encoder):
                  (<str:header name>, <str/int/float:header value>)
         :rtype: tuple
         """
-        encoded_header = []
-        # First try encoding the header as a "MMS-header"...
-        for assigned_number in mms_field_names:
-            header = mms_field_names[assigned_number][0]
-            if header == header_field_name:
-                encoded_header.extend(
-                    wsp_pdu.Encoder.encode_short_integer(assigned_number))
-                # Now encode the value
-                expected_type = mms_field_names[assigned_number][1]
-                try:
-                    ret = getattr(MMSEncoder,
-                                  'encode_%s' % expected_type)(header_value)
-                    encoded_header.extend(ret)
-                except wsp_pdu.EncodeError as e:
-                    raise wsp_pdu.EncodeError('Error encoding parameter '
-                                              'value: %s' % e)
-                except:
-                    logging.error('A fatal error occurred, probably due to an '
-                          'unimplemented encoding operation')
-                    raise
-
-                break
-
-        # See if the "MMS-header" encoding worked
-        if not len(encoded_header):
-            # ...it didn't. Use "Application-header" encoding
-            header_name = wsp_pdu.Encoder.encode_token_text(header_field_name)
-            encoded_header.extend(header_name)
-            # Now add the value
-            encoded_header.extend(
-                    wsp_pdu.Encoder.encode_text_string(header_value))
-
-        return encoded_header
+        encoded_header = bytearray()
+        _write_header(encoded_header, header_field_name, header_value)
+        return bytes(encoded_header)
 
     @staticmethod
     def encode_mms_field_name(field_name):
@@ -880,22 +980,14 @@ class MMSEncoder(wsp_pdu.Encoder):
         :type field_name: str
 
         :return: The encoded header field name, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
-        encoded_mms_field_name = []
-
-        for assigned_number in mms_field_names:
-            if mms_field_names[assigned_number][0] == field_name:
-                encoded_mms_field_name.extend(
-                        wsp_pdu.Encoder.encode_short_integer(assigned_number))
-                break
-
-        if not len(encoded_mms_field_name):
+        try:
+            return encoded_mms_field_names[field_name]
+        except KeyError:
             raise wsp_pdu.EncodeError('The specified header field name is not '
                                       'a well-known MMS header field name')
 
-        return encoded_mms_field_name
-
     @staticmethod
     def encode_from_value(from_value=''):
         """
@@ -914,44 +1006,26 @@ class MMSEncoder(wsp_pdu.Encoder):
         :type from_value: str
 
         :return: The encoded "From" address value, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
-        encoded_from_value = []
-        if len(from_value) == 0:
-            value_length = wsp_pdu.Encoder.encode_value_length(1)
-            encoded_from_value.extend(value_length)
-            encoded_from_value.append(129)  # Insert-address-token
-        else:
-            encoded_address = MMSEncoder.encode_encoded_string_value(from_value)
-            # the "+1" is for the Address-present-token
-            length = len(encoded_address) + 1
-            value_length = wsp_pdu.Encoder.encode_value_length(length)
-            encoded_from_value.extend(value_length)
-            encoded_from_value.append(128)  # Address-present-token
-            encoded_from_value.extend(encoded_address)
-
-        return encoded_from_value
-
-    @staticmethod
-    def encode_encoded_string_value(string_value):
-        """
-        Encodes ``string_value``
-
-        This is a simple wrapper to :func:`encode_text_string`
-
-        From [4], section 7.2.9::
-
-            Encoded-string-value = Text-string | Value-length Char-set Text-string
-
-        The Char-set values are registered by IANA as MIBEnum value.
-
-        :param string_value: The text string to encode
-        :type string_value: str
-
-        :return: The encoded string value, as a sequence of bytes
-        :rtype: list
-        """
-        return wsp_pdu.Encoder.encode_text_string(string_value)
+        if not from_value:
+            return _insert_address_from_value
+
+        encoded_address = MMSEncoder.encode_encoded_string_value(from_value)
+        # the "+1" is for the Address-present-token
+        value_length = wsp_pdu.Encoder.encode_value_length(
+                                                    len(encoded_address) + 1)
+        return b''.join((value_length, ADDRESS_PRESENT_TOKEN, encoded_address))
+
+    # Encodes an Encoded-string-value; from [4], section 7.2.9:
+    #
+    #     Encoded-string-value = Text-string | Value-length Char-set Text-string
+    #
+    # Char-sets are not supported, so this is just a Text-string. The same
+    # addresses and subjects tend to come up again and again, so the most
+    # recent encodings are kept
+    encode_encoded_string_value = staticmethod(functools.lru_cache(
+            maxsize=256)(wsp_pdu.Encoder.encode_text_string))
 
     @staticmethod
     def encode_message_type_value(message_type):
@@ -967,29 +1041,59 @@ class MMSEncoder(wsp_pdu.Encoder):
         :type message_type: str
 
         :return: The encoded message type, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
-        message_types = {
-            'm-send-req': 0x80,
-            'm-send-conf': 0x81,
-            'm-notification-ind': 0x82,
-            'm-notifyresp-ind': 0x83,
-            'm-retrieve-conf': 0x84,
-            'm-acknowledge-ind': 0x85,
-            'm-delivery-ind': 0x86,
-        }
-
-        return [message_types.get(message_type, 0x80)]
+        return encoded_message_type_values.get(message_type, b'\x80')
 
     @staticmethod
     def encode_status_value(status_value):
-        status_values = {
-            'Expired': 0x80,
-            'Retrieved': 0x81,
-            'Rejected': 0x82,
-            'Deferred': 0x83,
-            'Unrecognised': 0x84,
-        }
-
-        # Return an unrecognised state if it couldn't be decoded
-        return [status_values.get(status_value, 'Unrecognised')]
+        # Encode an unrecognised state if it isn't a known one
+        return encoded_status_values.get(status_value, b'\x84')
+
+
+# The encoded MMS-field-name of each MMS field and the MMSEncoder method
+# encoding its value (None if that is not implemented), in the format:
+# {<field name>: (<encoded field name>, <encoding function>)}
+mms_field_encoders = dict(
+    (name, (encoded_mms_field_names[name],
+            getattr(MMSEncoder, 'encode_%s' % value_type, None)))
+    for name, (assigned_number, value_type) in mms_field_numbers.items())
+
+
+def _write_header(buf, header_field_name, header_value):
+    """
+    Encodes a header entry for an MMS message at the end of ``buf``
+
+    See :func:`MMSEncoder.encode_header`, which this does the work of;
+    writing into the caller's buffer saves building (and copying) a
+    separate sequence of bytes for every header.
+
+    :param buf: The buffer to append the encoded header to
+    :type buf: bytearray
+    """
+    # First try encoding the header as a "MMS-header"...
+    field = mms_field_encoders.get(header_field_name)
+    if field is not None:
+        encoded_field_name, encode_value = field
+        if encode_value is None:
+            raise wsp_pdu.EncodeError('Encoding of the %s header is not '
+                                      'supported' % header_field_name)
+
+        # Now encode the value
+        try:
+            encoded_value = encode_value(header_value)
+        except wsp_pdu.EncodeError as e:
+            raise wsp_pdu.EncodeError('Error encoding parameter '
+                                      'value: %s' % e)
+        except:
+            logging.error('A fatal error occurred, probably due to an '
+                  'unimplemented encoding operation')
+            raise
+
+        buf += encoded_field_name
+        buf += encoded_value
+    else:
+        # ...it isn't one. Use "Application-header" encoding
+        buf += wsp_pdu.Encoder.encode_token_text(header_field_name)
+        # Now add the value
+        buf += wsp_pdu.Encoder.encode_text_string(header_value)
@@ -42,12 +42,9 @@ References used in the code and this document:
     U{http://www.openmobilealliance.org/tech/affiliates/LicenseAgreement.asp?DocName=/wap/wap-230-wsp-20010705-a.pdf}
 """
 
-import array
 from datetime import datetime
 import logging
 
-from messaging.mms.iterator import PreviewIterator
-
 WSP_PDU_TYPES = {
     0x01: 'Connect',
     0x02: 'ConnectReply',
@@ -220,6 +217,9 @@ HEADER_FIELD_NAMES = [
 # dynamically decoded
 HEADER_FIELD_ENCODINGS = {'Accept': 'accept_value', 'Pragma': 'pragma_value'}
 
+# The encoded Short-length values, indexed by length (0-30)
+ENCODED_SHORT_LENGTHS = [bytes((length,)) for length in range(31)]
+
 
 def get_header_field_names(version='1.2'):
     """
@@ -297,6 +297,17 @@ def get_well_known_parameters(version='1.2'):
     return versioned_params
 
 
+# Reverse lookup tables for the well-known parameters of each WSP encoding
+# version, in the format:
+# {<version>: {<param name>: (<assigned number>, <expected type>)}}
+# The highest assigned number wins for names that were assigned more than once
+WELL_KNOWN_PARAMETER_NUMBERS = dict(
+    (version, dict((name, (assigned_number, expected_type))
+                   for assigned_number, (name, expected_type)
+                   in sorted(get_well_known_parameters(version).items())))
+    for version in ('1.1', '1.2', '1.3', '1.4'))
+
+
 class DecodeError(Exception):
     """
     Raised when a decoding operation failed
@@ -314,7 +325,17 @@ class EncodeError(Exception):
 
 
 class Decoder:
-    """A WSP Data unit decoder"""
+    """
+    A WSP Data unit decoder
+
+    The decoders are fastest when handed a
+    :class:`messaging.mms.iterator.PreviewIterator`, but
+    :func:`decode_uint_var` and :func:`decode_text_string` also accept
+    plain iterators over a sequence of bytes: the former only ever calls
+    ``next()``, the latter falls back to reading one octet at a time.
+    """
+
+    __slots__ = ()
 
     @staticmethod
     def decode_uint_8(byte_iter):
@@ -352,8 +373,12 @@ class Decoder:
         :return: the decoded unsigned integer
         :rtype: int
         """
-        uint = 0
         byte = next(byte_iter)
+        if byte < 0x80:
+            # Single-octet uintvar: by far the most common case
+            return byte
+
+        uint = 0
         while (byte >> 7) == 0x01:
             uint = uint << 7
             uint |= byte & 0x7f
@@ -445,13 +470,8 @@ class Decoder:
         except DecodeError:
             raise DecodeError('short-length byte is invalid')
 
-        longInt = 0
-        # Decode the Multi-octect-integer
-        for i in range(shortLength):
-            longInt = longInt << 8
-            longInt |= next(byte_iter)
-
-        return longInt
+        # Decode the Multi-octect-integer (big-endian)
+        return int.from_bytes(byte_iter.read(shortLength), 'big')
 
     @staticmethod
     def decode_text_string(byte_iter, encoding = 'utf-8'):
@@ -473,15 +493,23 @@ class Decoder:
         :return: The decoded text string
         :rtype: str
         """
-        b_decoded_string = b''
-        byte = next(byte_iter)
-        # Remove Quote character (octet 127), if present
-        if byte == 127:
-            byte = next(byte_iter)
+        try:
+            # Remove Quote character (octet 127), if present
+            if byte_iter.peek(1) == b'\x7f':
+                next(byte_iter)
 
-        while byte != 0x00:
-            b_decoded_string += bytes([byte])
+            b_decoded_string = byte_iter.read_until(0x00)
+        except AttributeError:
+            # plain iterator, fall back to an octet-by-octet loop
+            b_decoded_string = b''
             byte = next(byte_iter)
+            # Remove Quote character (octet 127), if present
+            if byte == 127:
+                byte = next(byte_iter)
+
+            while byte != 0x00:
+                b_decoded_string += bytes([byte])
+                byte = next(byte_iter)
 
         try:
             # Lets try to decode it to the given encoding
@@ -559,19 +587,14 @@ class Decoder:
         :return: The decoded media type value
         :rtype: str
         """
-        media_value = ''
         byte = byte_iter.preview()
         if byte < 32 or byte == 127:
             byte_iter.reset_preview()
             raise DecodeError('Invalid Extension-media: TEXT '
                               'starts with invalid character: %d' % byte)
 
-        byte = next(byte_iter)
-        while byte != 0x00:
-            media_value += chr(byte)
-            byte = next(byte_iter)
-
-        return media_value
+        byte_iter.reset_preview()
+        return byte_iter.read_until(0x00).decode('latin-1')
 
     @staticmethod
     def decode_constrained_encoding(byte_iter):
@@ -643,22 +666,19 @@ class Decoder:
         :return: The decoded value length indicator
         :rtype: int
         """
-        length_value = 0
-        # Check for short-length
-        try:
-            length_value = Decoder.decode_short_length(byte_iter)
-        except DecodeError:
-            byte = byte_iter.preview()
-            # CHECK: this strictness MAY cause issues, but it is correct
-            if byte == 31:
-                next(byte_iter)  # skip past the length-quote
-                length_value = Decoder.decode_uint_var(byte_iter)
-            else:
-                byte_iter.reset_preview()
-                raise DecodeError('Invalid Value-length: not short-length, '
-                                  'and no length-quote present')
+        # Short-length and Length-quote are told apart by their first octet
+        byte = byte_iter.preview()
+        if byte <= 30:
+            return next(byte_iter)
 
-        return length_value
+        # CHECK: this strictness MAY cause issues, but it is correct
+        if byte == 31:
+            next(byte_iter)  # skip past the length-quote
+            return Decoder.decode_uint_var(byte_iter)
+
+        byte_iter.reset_preview()
+        raise DecodeError('Invalid Value-length: not short-length, '
+                          'and no length-quote present')
 
     @staticmethod
     def decode_integer_value(byte_iter):
@@ -847,11 +867,7 @@ class Decoder:
         value_length = Decoder.decode_value_length(byte_iter)
 
         # Read parameters, etc, until <value_length> is reached
-        ct_field_bytes = array.array('B')
-        for i in range(value_length):
-            ct_field_bytes.append(next(byte_iter))
-
-        ct_iter = PreviewIterator(ct_field_bytes)
+        ct_iter = byte_iter.split(value_length)
         # Now, decode all the bytes read
         media_type = Decoder.decode_media_type(ct_iter)
         # Decode the included paramaters (if any)
@@ -1411,6 +1427,8 @@ class Decoder:
 class Encoder:
     """A WSP Data unit decoder"""
 
+    __slots__ = ()
+
     @staticmethod
     def encode_uint_8(uint):
         """
@@ -1420,10 +1438,10 @@ class Encoder:
         :type byte_iter: int
 
         :return: the encoded uint_8, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
         # Make the byte unsigned
-        return [uint & 0xff]
+        return bytes((uint & 0xff,))
 
     @staticmethod
     def encode_uint_var(uint):
@@ -1444,8 +1462,8 @@ class Encoder:
         used octet is set to '1' to indicate more is to follow; the last used
         octet's "continue bit" is set to 0.
 
-        :return: the binary-encoded uint_var, as a list of byte values
-        :rtype: list
+        :return: the binary-encoded uint_var, as a sequence of bytes
+        :rtype: bytes
         """
         uint_var = [uint & 0x7f]
         # Since this is the lowest entry, we do not set the continue bit to 1
@@ -1455,7 +1473,7 @@ class Encoder:
             uint_var.insert(0, 0x80 | (uint & 0x7f))
             uint = uint >> 7
 
-        return uint_var
+        return bytes(uint_var)
 
     @staticmethod
     def encode_text_string(string):
@@ -1468,12 +1486,16 @@ class Encoder:
         :type string: str
 
         :return: the null-terminated, binary-encoded version of the
-                     specified Text-string, as a list of byte values
-        :rtype: list
+                     specified Text-string, as a sequence of bytes
+        :rtype: bytes
         """
-        encoded_string = [ord(c) for c in string]
-        encoded_string.append(0x00)
-        return encoded_string
+        encoded_string = string.encode('utf-8')
+        if encoded_string[:1] >= b'\x80':
+            # Quote = <Octet 127>: the first octet could otherwise be
+            # mistaken for a short-integer
+            return b'\x7f' + encoded_string + b'\x00'
+
+        return encoded_string + b'\x00'
 
     @staticmethod
     def encode_short_integer(integer):
@@ -1494,15 +1516,15 @@ class Encoder:
         :raise EncodeError: Not a valid short-integer; the integer must be in
                             the range of 0-127
 
-        :return: The encoded short integer, as a list of byte values
-        :rtype: list
+        :return: The encoded short integer, as a sequence of bytes
+        :rtype: bytes
         """
         if integer < 0 or integer > 127:
             raise EncodeError('Short-integer value must be in '
                               'range 0-127: %d' % integer)
 
         # Make sure the MSB is set
-        return [integer | 0x80]
+        return bytes((integer | 0x80,))
 
     @staticmethod
     def encode_long_integer(integer):
@@ -1524,26 +1546,24 @@ class Encoder:
         :type integer: int
 
         :return: The encoded Long-integer, as a sequence of byte values
-        :rtype: list
+        :rtype: bytes
         """
         if not isinstance(integer, int):
             raise EncodeError('<integer> must be of type "int"')
 
-        encoded_long_int = []
-        longInt = integer
-        # Encode the Multi-octect-integer
-        while longInt > 0:
-            byte = 0xff & longInt
-            encoded_long_int.append(byte)
-            longInt = longInt >> 8
+        if integer < 0:
+            raise EncodeError('Cannot encode Long-integer value: it must '
+                              'not be negative')
 
-        # Now add the SHort-length value, and make sure it's ok
-        shortLength = len(encoded_long_int)
+        # The Multi-octet-integer is big-endian, with no leading zero octets
+        shortLength = (integer.bit_length() + 7) // 8
+        # Now make sure the Short-length value is ok
         if shortLength > 30:
             raise EncodeError('Cannot encode Long-integer value: Short-length '
                               'is too long; should be in octet range 0-30')
-        encoded_long_int.insert(0, shortLength)
-        return encoded_long_int
+
+        return (ENCODED_SHORT_LENGTHS[shortLength]
+                + integer.to_bytes(shortLength, 'big'))
 
     @staticmethod
     def encode_version_value(version):
@@ -1562,13 +1582,13 @@ class Encoder:
 
         :raise TypeError: The specified version value was not of type `str`
 
-        :return: the encoded version value, as a list of byte values
-        :rtype: list
+        :return: the encoded version value, as a sequence of bytes
+        :rtype: bytes
         """
         if not isinstance(version, str):
             raise TypeError('Parameter must be of type "str"')
 
-        encoded_version_val = []
+        encoded_version_val = b''
         # First try short-integer encoding
         try:
             if len(version.split('.')) <= 2:
@@ -1608,9 +1628,8 @@ class Encoder:
         :param content_type: The MIME content type to encode
         :type content_type: str
 
-        :return: The binary-encoded content type, as a list of (integer) byte
-                 values
-        :rtype: list
+        :return: The binary-encoded content type, as a sequence of bytes
+        :rtype: bytes
         """
         if content_type in WELL_KNOWN_CONTENT_TYPES:
             # Short-integer encoding
@@ -1619,7 +1638,7 @@ class Encoder:
         else:
             val = Encoder.encode_text_string(content_type)
 
-        return [val]
+        return val
 
     @staticmethod
     def encode_parameter(parameter_name, parameter_value, version='1.2'):
@@ -1650,48 +1669,46 @@ class Encoder:
 
         :raise ValueError: The specified encoding version is invalid.
 
-        :return: The binary-encoded parameter name, as a list of (integer)
-                 byte values
-        :rtype: list
+        :return: The binary-encoded parameter name, as a sequence of bytes
+        :rtype: bytes
         """
-        wk_params = get_well_known_parameters(version)
-        encoded_parameter = []
-        # Try to encode the parameter using a "Typed-parameter" value
-        wkParamNumbers = wk_params.keys()
-        wkParamNumbers.sort(reverse=True)
-        for assigned_number in wkParamNumbers:
-            if wk_params[assigned_number][0] == parameter_name:
-                # Ok, it's a Typed-parameter; encode the parameter name
-                encoded_parameter.extend(
-                        Encoder.encode_short_integer(assigned_number))
-                # and now the value
-                expected_type = wk_params[assigned_number][1]
-                try:
-                    ret = getattr(Encoder,
-                                  'encode_%s' % expected_type)(parameter_value)
-                    encoded_parameter.extend(ret)
-                except EncodeError as e:
-                    raise EncodeError('Error encoding param value: %s' % e)
-                except:
-                    logging.error('A fatal error occurred, probably due to an '
-                          'unimplemented encoding operation')
-                    raise
-                break
+        try:
+            wk_param_numbers = WELL_KNOWN_PARAMETER_NUMBERS[version]
+        except KeyError:
+            raise ValueError('version must be "1.1",'
+                             '"1.2", "1.3" or "1.4"')
 
-        # See if the "Typed-parameter" encoding worked
-        if len(encoded_parameter) == 0:
-            # it didn't. Use "Untyped-parameter" encoding
-            encoded_parameter.extend(Encoder.encode_token_text(parameter_name))
-            value = []
+        encoded_parameter = bytearray()
+        # Try to encode the parameter using a "Typed-parameter" value
+        try:
+            assigned_number, expected_type = wk_param_numbers[parameter_name]
+        except KeyError:
+            # it isn't one. Use "Untyped-parameter" encoding
+            encoded_parameter += Encoder.encode_token_text(parameter_name)
+            value = b''
             # First try to encode the untyped-value as an integer
             try:
                 value = Encoder.encode_integer_value(parameter_value)
             except EncodeError:
                 value = Encoder.encode_text_string(parameter_value)
 
-            encoded_parameter.extend(value)
+            encoded_parameter += value
+            return bytes(encoded_parameter)
+
+        # Ok, it's a Typed-parameter; encode the parameter name
+        encoded_parameter += Encoder.encode_short_integer(assigned_number)
+        # and now the value
+        try:
+            ret = getattr(Encoder, 'encode_%s' % expected_type)(parameter_value)
+            encoded_parameter += ret
+        except EncodeError as e:
+            raise EncodeError('Error encoding param value: %s' % e)
+        except:
+            logging.error('A fatal error occurred, probably due to an '
+                  'unimplemented encoding operation')
+            raise
 
-        return encoded_parameter
+        return bytes(encoded_parameter)
 
     # TODO: check up on the encoding/decoding of Token-text, in particular,
     # how does this differ from text-string? does it have 0x00 at the end?
@@ -1702,8 +1719,8 @@ class Encoder:
 
         :raise EncodeError: Specified text cannot be encoding as a token
 
-        :return: The encoded token string, as a list of byte values
-        :rtype: list
+        :return: The encoded token string, as a sequence of bytes
+        :rtype: bytes
         """
         separators = (11, 32, 40, 41, 44, 47, 58, 59, 60, 61, 62, 63, 64,
                       91, 92, 93, 123, 125)
@@ -1731,8 +1748,8 @@ class Encoder:
 
         :raise EncodeError: The <integer> parameter is not of type `int`
 
-        :return: The encoded integer value, as a list of byte values
-        :rtype: list
+        :return: The encoded integer value, as a sequence of bytes
+        :rtype: bytes
         """
         if not isinstance(integer, int):
             raise EncodeError('<integer> must be of type "int"')
@@ -1760,10 +1777,10 @@ class Encoder:
                       method complies with the format of the other `encode`
                       methods.
 
-        :return: A list containing a single "No-value", which is 0x00
-        :rtype: list
+        :return: A single "No-value" byte, which is 0x00
+        :rtype: bytes
         """
-        return [0x00]
+        return b'\x00'
 
     @staticmethod
     def encode_header(field_name, value):
@@ -1782,19 +1799,19 @@ class Encoder:
 
         :return: The encoded header, and its value, as a sequence of
                  byte values
-        :rtype: list
+        :rtype: bytes
         """
-        encoded_header = []
+        encoded_header = bytearray()
         # First try encoding the header name as a "well-known-header"...
         wkHdrFields = get_header_field_names()
         if field_name in wkHdrFields:
             header_field_value = Encoder.encode_short_integer(
                                     wkHdrFields.index(field_name))
-            encoded_header.extend(header_field_value)
+            encoded_header += header_field_value
         else:
             # otherwise, encode it as an "application header"
             encoded_header_name = Encoder.encode_token_text(field_name)
-            encoded_header.extend(encoded_header_name)
+            encoded_header += encoded_header_name
 
         # Now add the value
         # TODO: make this flow better (see also Decoder.decode_header)
@@ -1804,7 +1821,7 @@ class Encoder:
             wap_value_type = HEADER_FIELD_ENCODINGS[field_name]
             try:
                 ret = getattr(Encoder, 'encode_%s' % wap_value_type)(value)
-                encoded_header.extend(ret)
+                encoded_header += ret
             except EncodeError as e:
                 raise EncodeError('Error encoding Wap-value: %s' % e)
             except:
@@ -1812,9 +1829,9 @@ class Encoder:
                       'unimplemented encoding operation')
                 raise
         else:
-            encoded_header.extend(Encoder.encode_text_string(value))
+            encoded_header += Encoder.encode_text_string(value)
 
-        return encoded_header
+        return bytes(encoded_header)
 
     @staticmethod
     def encode_content_type_value(media_type, parameters):
@@ -1831,7 +1848,7 @@ class Encoder:
 
         :return: The encoded Content-type-value (including parameters, if
                  any), as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
         # First try do encode it using Constrained-media encoding
         try:
@@ -1861,7 +1878,7 @@ class Encoder:
         :raise EncodeError: Media value is unsuitable for Constrained-encoding
 
         :return: The encoded media type, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
         # See if this value is in the table of well-known content types
         if media_type in WELL_KNOWN_CONTENT_TYPES:
@@ -1888,7 +1905,7 @@ class Encoder:
 
         :return: The encoded constrained-encoding token value, as a sequence
                  of bytes
-        :rtype: list
+        :rtype: bytes
         """
         encoded_value = None
         if isinstance(value, int):
@@ -1951,23 +1968,19 @@ class Encoder:
         :func:`decode_content_type_value`.
 
         :return: The encoded Content-general-form, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
-        enconded_content_general_form = []
-        encoded_media_type = []
         # Encode the actual content type
         encoded_media_type = Encoder.encode_media_type(media_type)
         # Encode all parameters
-        encoded_parameters = [Encoder.encode_parameter(name, parameters[name])
-                                    for name in parameters]
+        encoded_parameters = b''.join(
+                Encoder.encode_parameter(name, parameters[name])
+                for name in parameters)
 
         value_length = len(encoded_media_type) + len(encoded_parameters)
         encoded_value_length = Encoder.encode_value_length(value_length)
-        enconded_content_general_form.extend(encoded_value_length)
-        enconded_content_general_form.extend(encoded_media_type)
-        enconded_content_general_form.extend(encoded_parameters)
 
-        return enconded_content_general_form
+        return encoded_value_length + encoded_media_type + encoded_parameters
 
     @staticmethod
     def encode_value_length(length):
@@ -1988,18 +2001,15 @@ class Encoder:
         :raise EncodeError: The value_length could not be encoded.
 
         :return: The encoded value length indicator, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
-        encoded_value_length = []
         # Try and encode it as a short-length
-        try:
-            encoded_value_length = Encoder.encode_short_length(length)
-        except EncodeError:
-            # Encode it with a Length-quote and uint_var
-            encoded_value_length.append(31)  # Length-quote
-            encoded_value_length.extend(Encoder.encode_uint_var(length))
+        if 0 <= length <= 30:
+            return ENCODED_SHORT_LENGTHS[length]
 
-        return encoded_value_length
+        # Encode it with a Length-quote and uint_var
+        return (b'\x1f'  # Length-quote
+                + Encoder.encode_uint_var(length))
 
     @staticmethod
     def encode_short_length(length):
@@ -2012,13 +2022,13 @@ class Encoder:
                             short-length value; it is not in octet range 0-30.
 
         :return: The encoded short-length, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
         if length < 0 or length > 30:
             raise EncodeError('Cannot encode short-length; length should '
                               'be in the 0-30 range')
 
-        return [length]
+        return ENCODED_SHORT_LENGTHS[length]
 
     @staticmethod
     def encode_accept_value(accept_value):
@@ -2041,9 +2051,9 @@ class Encoder:
         :raise EncodeError: The encoding failed.
 
         :return: The encoded Accept-value, as a sequence of bytes
-        :rtype: list
+        :rtype: bytes
         """
-        encoded_accept_value = []
+        encoded_accept_value = b''
         # Try to use Constrained-media encoding
         try:
             encoded_accept_value = Encoder.encode_constrained_media(accept_value)
@@ -2055,7 +2065,6 @@ class Encoder:
                 raise EncodeError('Cannot encode Accept-value: %s' % e)
 
             value_length = Encoder.encode_value_length(len(encoded_media_range))
-            encoded_accept_value = value_length
-            encoded_accept_value.extend(encoded_media_range)
+            encoded_accept_value = value_length + encoded_media_range
 
         return encoded_accept_value
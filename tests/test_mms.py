@@ -5,7 +5,10 @@ import os
 import binascii
 from unittest import TestCase
 
-from messaging.mms.message import MMSMessage
+from messaging.mms.message import DataPart, MMSMessage, MMSMessagePage
+from messaging.mms.iterator import PreviewIterator
+from messaging.mms.mms_pdu import MMSEncoder
+from messaging.mms.wsp_pdu import Decoder, Encoder
 
 # test data extracted from heyman's
 # http://github.com/heyman/mms-decoder
@@ -377,3 +380,127 @@ class TestMmsDecoding(TestCase):
             149, 129, 132, 163, 1, 35, 129]
 
         self.assertEqual(list(message.encode()[:50]), data)
+
+    def test_encoding_content_type_parameters(self):
+        message = MMSMessage()
+        message.headers['To'] = '1337/TYPE=PLMN'
+        content_type = ('application/vnd.wap.multipart.related',
+                        {'Start': '<smil>', 'Type': 'application/smil'})
+        message.headers['Content-Type'] = content_type
+
+        data = message.encode()
+        self.assertTrue(isinstance(data, bytes))
+        mms = MMSMessage.from_data(data)
+        self.assertEqual(mms.headers['Content-Type'], content_type)
+
+    def test_encoding_text_page_roundtrip(self):
+        message = MMSMessage()
+        message.headers['To'] = '1337/TYPE=PLMN'
+        page = MMSMessagePage()
+        page.add_text('Jonatan är en GNU')
+        message.add_page(page)
+
+        mms = MMSMessage.from_data(message.encode())
+        self.assertEqual(len(mms.data_parts), 2)
+        self.assertEqual(mms.data_parts[0].content_type, 'application/smil')
+        self.assertEqual(mms.data_parts[1].content_type, 'text/plain')
+        self.assertEqual(mms.data_parts[1].data,
+                         'Jonatan är en GNU'.encode('utf-8'))
+
+    def test_encoding_data_part_roundtrip(self):
+        message = MMSMessage()
+        message.headers['To'] = '1337/TYPE=PLMN'
+        part = DataPart()
+        part.set_data(b'\x00\x01\x02', 'application/octet-stream')
+        message.add_data_part(part)
+
+        mms = MMSMessage.from_data(message.encode())
+        self.assertEqual(len(mms.data_parts), 2)
+        self.assertEqual(mms.data_parts[0].content_type, 'application/smil')
+        self.assertEqual(mms.data_parts[1].content_type,
+                         'application/octet-stream')
+        self.assertEqual(mms.data_parts[1].data, b'\x00\x01\x02')
+
+    def test_encoding_leaves_headers_untouched(self):
+        message = MMSMessage()
+        message.headers['To'] = '1337/TYPE=PLMN'
+        message.headers['X-Mms-Version'] = '1.2'
+        headers = dict(message.headers)
+
+        data = message.encode()
+        self.assertEqual(message.headers, headers)
+        self.assertEqual(message.encode(), data)
+        mms = MMSMessage.from_data(data)
+        self.assertEqual(mms.headers['MMS-Version'], '1.2')
+        self.assertEqual(mms.headers['Transaction-Id'], '1234')
+
+    def test_encoding_mms_values(self):
+        self.assertEqual(MMSEncoder.encode_from_value(''), b'\x01\x81')
+        self.assertEqual(MMSEncoder.encode_from_value('+3412345678'),
+                         b'\x0d\x80+3412345678\x00')
+        self.assertEqual(MMSEncoder.encode_message_type_value('m-send-req'),
+                         b'\x80')
+        self.assertEqual(MMSEncoder.encode_status_value('Retrieved'), b'\x81')
+        self.assertEqual(MMSEncoder.encode_status_value('bogus'), b'\x84')
+
+    def test_encoding_text_string(self):
+        self.assertEqual(Encoder.encode_text_string('Subject'),
+                         b'Subject\x00')
+        self.assertEqual(Encoder.encode_text_string('\xd1and\xfa'),
+                         b'\x7f\xc3\x91and\xc3\xba\x00')
+
+        message = MMSMessage()
+        message.headers['To'] = '1337/TYPE=PLMN'
+        message.headers['Subject'] = '\xd1and\xfa'
+        mms = MMSMessage.from_data(message.encode())
+        self.assertEqual(mms.headers['Subject'], '\xd1and\xfa')
+
+
+class TestWspDecoding(TestCase):
+
+    def test_decode_uint_var(self):
+        for value in (0, 1, 0x7f, 0x80, 0x3fff, 0x4000, 0x1fffff,
+                      0xfffffff, 0xffffffff, 0x7ffffffff, 2 ** 40):
+            data = Encoder.encode_uint_var(value)
+            byte_iter = PreviewIterator(data + b'\x2a')
+            self.assertEqual(Decoder.decode_uint_var(byte_iter), value)
+            self.assertEqual(next(byte_iter), 0x2a)
+            # plain iterators are still accepted
+            self.assertEqual(Decoder.decode_uint_var(iter(data)), value)
+
+    def test_decode_uint_var_truncated(self):
+        self.assertRaises(StopIteration, Decoder.decode_uint_var,
+                          PreviewIterator([0x81, 0x80]))
+
+    def test_decode_text_string(self):
+        for data in (b'abc\x00*', b'\x7fabc\x00*'):
+            byte_iter = PreviewIterator(data)
+            self.assertEqual(Decoder.decode_text_string(byte_iter), 'abc')
+            self.assertEqual(next(byte_iter), 0x2a)
+            # plain iterators are still accepted
+            byte_iter = iter(data)
+            self.assertEqual(Decoder.decode_text_string(byte_iter), 'abc')
+            self.assertEqual(next(byte_iter), 0x2a)
+
+    def test_preview_iterator_split(self):
+        byte_iter = PreviewIterator(b'\x01\x02\x03\x04')
+        self.assertEqual(next(byte_iter), 1)
+        sub_iter = byte_iter.split(2)
+        self.assertEqual(list(sub_iter), [2, 3])
+        self.assertEqual(byte_iter.position, 3)
+        self.assertEqual(list(byte_iter), [4])
+
+    def test_preview_iterator_reset(self):
+        byte_iter = PreviewIterator(b'\x01\x02\x03\x04')
+        self.assertEqual(list(byte_iter), [1, 2, 3, 4])
+        byte_iter.reset(1, 3)
+        self.assertEqual(byte_iter.preview(), 2)
+        self.assertEqual(list(byte_iter), [2, 3])
+
+    def test_long_integer_roundtrip(self):
+        for value in (0, 1, 0xff, 0x100, 300000, 2 ** 64):
+            data = Encoder.encode_long_integer(value)
+            byte_iter = PreviewIterator(data)
+            self.assertEqual(Decoder.decode_long_integer(byte_iter), value)
+        self.assertEqual(Encoder.encode_long_integer(300000),
+                         b'\x03\x04\x93\xe0')